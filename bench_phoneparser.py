@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of phoneparser.parse_phone against the previous list-based implementation.
+
+Checks that both implementations give the same output for typical Boxberry phone formats,
+then times parsing without memoization and with memoization starting from an empty cache.
+
+Usage: python bench_phoneparser.py [--points N] [--repeat N]
+"""
+import argparse
+import random
+import timeit
+
+from errors import PointParseError
+from phoneparser import parse_phone
+
+# Formats seen in Boxberry `Phone` field
+PHONE_FORMATS = (
+    '8-800-222-80-00',
+    '8 (800) 222-80-00',
+    '+7 (495) 123-45-67',
+    '+7(495)1234567',
+    '8(812)3216547',
+    '8 912 345 67 89',
+    '79123456789',
+    '89123456789',
+    '+79123456789',
+    '8-(3452)-56-78-90',
+    '(495) 123-45-67',
+    '8 800 700 54 30 доб. 2',
+)
+
+
+def parse_phone_legacy(raw_phone: str):
+    phone = list(raw_phone)
+    trim = (')', '(', '-', ' ')
+    for symbol in trim:
+        while symbol in phone:
+            phone.remove(symbol)
+
+    if phone[0] != '+':
+        if phone[0] == '8':
+            phone[0] = '7'
+        phone = ['+'] + phone
+
+    if len(phone) != 12:
+        raise PointParseError('invalid phone: {}'.format(raw_phone))
+
+    phone = ''.join(phone)
+
+    return '{} ({}) {}-{}-{}'.format(phone[:2], phone[2:5], phone[5:8], phone[8:10], phone[10:12])
+
+
+def parse_or_error(parse, raw_phone: str) -> str:
+    try:
+        return parse(raw_phone)
+    except PointParseError as e:
+        return 'error: {}'.format(e)
+
+
+def make_phones(count: int) -> list:
+    # Call-center numbers dominate, the rest are unique local numbers
+    rnd = random.Random(0)
+    phones = []
+    for _ in range(count):
+        if rnd.random() < 0.6:
+            phones.append(rnd.choice(PHONE_FORMATS[:2]))
+        else:
+            phones.append(rnd.choice(PHONE_FORMATS).replace('123', '{:03}'.format(rnd.randrange(1000))))
+    return phones
+
+
+def check_output(phones: list):
+    for raw_phone in set(phones) | set(PHONE_FORMATS):
+        legacy = parse_or_error(parse_phone_legacy, raw_phone)
+        current = parse_or_error(parse_phone.__wrapped__, raw_phone)
+        if legacy != current:
+            raise AssertionError('{!r}: {!r} != {!r}'.format(raw_phone, current, legacy))
+
+
+def run_all(parse, phones: list):
+    for raw_phone in phones:
+        parse_or_error(parse, raw_phone)
+
+
+def main():
+    bench_arg_parser = argparse.ArgumentParser(description='Benchmarks phoneparser.parse_phone')
+    bench_arg_parser.add_argument('--points', type=int, default=10000, help='Number of phones to parse per run')
+    bench_arg_parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs')
+    args = bench_arg_parser.parse_args()
+
+    phones = make_phones(args.points)
+    check_output(phones)
+    print('Output matches the legacy implementation for {} distinct phones'.format(len(set(phones))))
+
+    timings = (
+        ('legacy', parse_phone_legacy),
+        ('single pass', parse_phone.__wrapped__),
+        ('memoized', parse_phone),
+    )
+    legacy_time = None
+    for name, parse in timings:
+        # Every repeat starts with an empty cache, like a real run: the memoized row shows the gain of deduplication
+        parse_time = min(timeit.repeat(lambda: run_all(parse, phones), setup=parse_phone.cache_clear, number=1,
+                                       repeat=args.repeat))
+        legacy_time = legacy_time or parse_time
+        print('{:<12}{:>10.2f} ms{:>8.1f}x'.format(name, parse_time * 1000, legacy_time / parse_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,23 +6,32 @@ from typing import Optional, Union
 import requests
 from requests import RequestException
 
-from config_parser import general_config
-from errors import BoxberryError, ClientError, ClientConnectionError
+from errors import BoxberryError, ClientError, ClientConnectionError, ClientNotFoundError, ClientRateLimitError, \
+    RegionNotFoundError
+from limiter import AdaptiveLimiter
 from logger import logger
-from normalize_dict import STRONG_NORMALIZE, REGULAR_NORMALIZE
+from normalize_dict import convert_region_names_for_yandex  # noqa: F401, kept importable from client
 
 
 class Client:
-    def __init__(self):
+    def __init__(self, max_attempts: int = 10, limiter: AdaptiveLimiter = None):
         self.service_name = None
         self._session = requests.Session()
         self._base_request = None
         self._timeout = 10
+        self._max_attempts = max_attempts
+        self.limiter = limiter or AdaptiveLimiter(name='Service')
 
     def check_and_convert_response(self, response: requests.Response) -> Union[dict, list]:
         status_code = response.status_code
 
-        if str(status_code)[0] == '5' or status_code == 404:  # Server, connection error or 404
+        if status_code in (420, 429):
+            raise ClientRateLimitError(service=self.service_name, error_text=response.text)
+
+        elif status_code == 404:
+            raise ClientNotFoundError(service=self.service_name, error_text=response.text)
+
+        elif str(status_code)[0] == '5':  # Server or connection error
             raise ClientConnectionError(service=self.service_name, error_text=response.text)
 
         elif str(status_code)[0] != '2':
@@ -72,36 +81,42 @@ class Client:
         delete_request.method = 'DELETE'
         return delete_request.prepare()
 
-    def send(self,
-             prepared_request: requests.PreparedRequest,
-             timeout: int = 10) -> Union[list, dict]:
+    def send(self, prepared_request: requests.PreparedRequest) -> Union[list, dict]:
         response = 'No response'
 
-        for i in range(1, int(general_config['max_attempts'])):
-            try:
-                response = self._session.send(prepared_request, timeout=self._timeout)
-            except RequestException as e:
-                logger.warn(msg=e)
-                continue
+        for i in range(1, self._max_attempts):
+            with self.limiter:
+                sent_at = time.monotonic()
+                try:
+                    response = self._session.send(prepared_request, timeout=self._timeout)
+                except RequestException as e:
+                    logger.warn(msg=e)
+                    self.limiter.on_throttle(sent_at)
+                    continue
             try:
                 dict_response = self.check_and_convert_response(response)
-            except ClientConnectionError:
-                logger.warn(msg='{} did not respond. Attempt  #{}'.format(self.service_name, i))
-                # Try to perform new request
-                time.sleep(timeout)
+            except ClientNotFoundError as e:
+                # Not a sign of overload, retried without cutting the limits
+                logger.warn(msg='{} did not find the resource. Attempt  #{}. {}'.format(self.service_name, i, e))
+            except ClientConnectionError as e:
+                logger.warn(msg='{} did not respond. Attempt  #{}. {}'.format(self.service_name, i, e))
+                # Next attempt waits for the slot of the reduced rate
+                self.limiter.on_throttle(sent_at)
             except ClientError as e:
                 logger.error(msg=e)
                 raise e
             else:
+                self.limiter.on_success()
                 return dict_response
-        raise ClientConnectionError('Can not get data after {} attempts. {}'.format(int(general_config['max_attempts']),
-                                                                                    response.text))
+        raise ClientConnectionError('Can not get data after {} attempts. {}'.format(
+            self._max_attempts, getattr(response, 'text', response)))
 
 
 class BoxberryClient(Client):
 
-    def __init__(self, token: str, api_url: object = None):
-        Client.__init__(self)
+    def __init__(self, token: str, api_url: object = None, max_attempts: int = 10):
+        # Boxberry allows 2 parallel requests per token
+        Client.__init__(self, max_attempts=max_attempts, limiter=AdaptiveLimiter(name='Boxberry', max_concurrency=2))
         self.service_name = 'Boxberry'
         self._token = token
         self._api_url = api_url or 'http://api.boxberry.ru/json.php'
@@ -111,8 +126,15 @@ class BoxberryClient(Client):
         status_code = response.status_code
         loaded_response = json.loads(response.text)
 
-        if str(status_code)[0] == '5' or status_code in (404, 402):
-            # Server, connection error, 404 or incorrect `402: Hit rate limit of 2 parallel requests`
+        if status_code == 402:
+            # Incorrect `402: Hit rate limit of 2 parallel requests`
+            raise ClientRateLimitError(service=self.service_name, error_text=response.text)
+
+        elif status_code == 404:
+            raise ClientNotFoundError(service=self.service_name, error_text=response.text)
+
+        elif str(status_code)[0] == '5':
+            # Server or connection error
             raise ClientConnectionError(service=self.service_name, error_text=response.text)
 
         elif str(status_code)[0] != '2':
@@ -180,8 +202,11 @@ class BoxberryClient(Client):
 
 
 class YandexMarketClient(Client):
-    def __init__(self, ym_token: str, ym_client_id: str, ym_campaign_id: str, ym_api_url=None):
-        Client.__init__(self)
+    def __init__(self, ym_token: str, ym_client_id: str, ym_campaign_id: str, ym_api_url=None,
+                 max_attempts: int = 10):
+        # Outlet phases send requests one by one, so Yandex only gets rate control
+        Client.__init__(self, max_attempts=max_attempts,
+                        limiter=AdaptiveLimiter(name='YandexMarket', max_concurrency=1))
         self.service_name = 'YandexMarket'
         self._ym_token = ym_token
         self._ym_client_id = ym_client_id
@@ -192,6 +217,9 @@ class YandexMarketClient(Client):
                                                   'oauth_token': self._ym_token,
                                                   'oauth_client_id': self._ym_client_id
                                               })
+        # Region lookups of the run: parsed `regions` by city name and resolved ids by (city name, area)
+        self._regions_cache = {}
+        self._region_ids_cache = {}
         self._init_outlets_url()
 
     def _init_outlets_url(self):
@@ -213,7 +241,6 @@ class YandexMarketClient(Client):
             response_dict = self.send(rq)
             new_entities = response_dict.get(list_name)
             entities_list += new_entities
-            time.sleep(1)
         return entities_list
 
     def get_published_outlets(self) -> list:
@@ -253,68 +280,53 @@ class YandexMarketClient(Client):
         rq = self.prepare_delete(request=outlet_delete_request)
         self.send(rq)
 
-    def get_region_id(self, bxb_point, attempts=10):
-        region_get_request = deepcopy(
-            self._base_request
-        )
+    def get_regions(self, city_name: str) -> list:
+        if city_name not in self._regions_cache:
+            region_get_request = deepcopy(
+                self._base_request
+            )
+            region_get_request.url = self._api_url + 'regions.json'
+            region_get_request.params.update({'name': city_name})
 
+            rq = self.prepare_get(request=region_get_request)
+            # 5xx are retried by send, 4xx will not succeed on retry
+            self._regions_cache[city_name] = self.send(rq).get('regions') or []
+        return self._regions_cache[city_name]
+
+    def get_region_id(self, bxb_point) -> int:
         city_name = bxb_point.get('CityName')
         if not city_name:
             return
 
-        region_get_request.url = self._api_url + 'regions.json'
-        region_get_request.params.update({'name': city_name})
-
-        rq = self.prepare_get(request=region_get_request)
+        area_name = bxb_point.get('Area')
+        cache_key = (city_name, area_name)
+        if cache_key not in self._region_ids_cache:
+            self._region_ids_cache[cache_key] = self._find_region_id(self.get_regions(city_name), area_name)
 
-        for _ in range(attempts):
-            try:
-                regions_response = self.send(rq)
-            except ClientError:
-                continue
-
-            regions = regions_response.get('regions')
-
-            if not regions:
-                raise ClientError('No region {} was found in Yandex.API'.format(city_name))
-
-            if len(regions) > 1:
-                for region in regions:
-                    region_id = None
-                    found_areas = []
-                    area_name = bxb_point.get('Area')
+        region_id = self._region_ids_cache[cache_key]
+        if region_id is None:
+            raise RegionNotFoundError(city_name=city_name, area_name=area_name)
+        return region_id
 
-                    while 'parent' in region.keys():
-                        if region.get('type') in ('TOWN', 'CITY', 'REPUBLIC_AREA') and not region_id:
-                            region_id = region['id']
-                        found_areas.append(region.get('name'))
-                        region = region['parent']
+    @staticmethod
+    def _find_region_id(regions: list, area_name: str) -> Optional[int]:
+        if len(regions) > 1:
+            for region in regions:
+                region_id = None
+                found_areas = []
 
-                    if area_name in found_areas:
-                        return region_id
-
-            else:
-                region = regions[0]
                 while 'parent' in region.keys():
-                    if region.get('type') in ('TOWN', 'CITY', 'REPUBLIC_AREA'):
-                        return region['id']
+                    if region.get('type') in ('TOWN', 'CITY', 'REPUBLIC_AREA') and not region_id:
+                        region_id = region['id']
+                    found_areas.append(region.get('name'))
                     region = region['parent']
 
+                if area_name in found_areas:
+                    return region_id
 
-def convert_region_names_for_yandex(point):
-    area = point.get('Area')
-    strong_normalized = False
-    for item, replacement in STRONG_NORMALIZE.items():
-        if item in area:
-            area = area.replace(item, replacement)
-            strong_normalized = True
-
-    if not strong_normalized:
-        if 'Респ' in area:
-            area = 'Республика {}'.format(area)
-        for item, replacement in REGULAR_NORMALIZE.items():
-            area = area.replace(item, replacement)
-
-    point['Area'] = area
-
-    return point
+        elif regions:
+            region = regions[0]
+            while 'parent' in region.keys():
+                if region.get('type') in ('TOWN', 'CITY', 'REPUBLIC_AREA'):
+                    return region['id']
+                region = region['parent']
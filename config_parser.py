@@ -1,8 +1,9 @@
 import configparser
 
-config = configparser.ConfigParser()
-config.read('config.ini')
+CONFIG_FILE_NAME = 'config.ini'
 
-bxb_config = config['Boxberry']
-ym_config = config['YandexMarket']
-general_config = config['General']
+
+def read_config(file_name: str = CONFIG_FILE_NAME) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read(file_name)
+    return config
@@ -0,0 +1,161 @@
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+from config_parser import CONFIG_FILE_NAME
+
+# Modules imported on first use of the database or clients, heaviest dependencies first
+LAZY_MODULES = ('sqlalchemy', 'requests', 'db', 'models', 'client')
+
+
+class AppContext:
+    """
+    Holds config, database session and API clients of the application.
+    Every part is initialised on first access, so importing modules or parsing CLI arguments stays cheap.
+    """
+
+    def __init__(self, config_file_name: str = CONFIG_FILE_NAME, database_url: str = None):
+        self.config_file_name = config_file_name
+        self.database_url = database_url
+        self.timings = OrderedDict()
+        self._config = None
+        self._db_ready = False
+        self._db_lock = threading.Lock()
+        self._bxb_client = None
+        self._ym_client = None
+
+    def _timed(self, stage: str, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings[stage] = self.timings.get(stage, 0) + time.perf_counter() - started
+        return result
+
+    # Config
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = self._timed('config', self._init_config)
+        return self._config
+
+    @config.setter
+    def config(self, config):
+        self._config = config
+
+    def _init_config(self):
+        from config_parser import read_config
+        from logger import setup_logging
+
+        config = read_config(self.config_file_name)
+        setup_logging(config['General'].get('log_file_name') if config.has_section('General') else None)
+        return config
+
+    @property
+    def bxb_config(self):
+        return self.config['Boxberry']
+
+    @property
+    def ym_config(self):
+        return self.config['YandexMarket']
+
+    @property
+    def general_config(self):
+        return self.config['General']
+
+    @property
+    def max_attempts(self) -> int:
+        return int(self.general_config.get('max_attempts', 10))
+
+    @property
+    def bxb_tokens(self) -> list:
+        return [token.strip() for token in self.bxb_config['boxberry_token'].split(',') if token.strip()]
+
+    # Database
+
+    @property
+    def session(self):
+        import db
+
+        if not self._db_ready:
+            with self._db_lock:
+                if not self._db_ready:
+                    self._timed('database', self._init_db)
+                    self._db_ready = True
+        # Session of the current thread
+        return db.get_session()
+
+    def _init_db(self):
+        import db
+        import models
+
+        db.get_engine(self.database_url)
+        models.create_tables()
+
+    def reset_db(self):
+        """
+        Forgets the session and connections inherited by a forked worker process, without closing them
+        """
+        if self._db_ready:
+            import db
+            db.reset_connections()
+
+    # Clients
+
+    @property
+    def bxb_client(self):
+        if self._bxb_client is None:
+            self._bxb_client = self._timed('boxberry client', self.create_bxb_client)
+        return self._bxb_client
+
+    @bxb_client.setter
+    def bxb_client(self, client):
+        self._bxb_client = client
+
+    def create_bxb_client(self, token: str = None):
+        from client import BoxberryClient
+
+        return BoxberryClient(token=token or self.bxb_tokens[0], max_attempts=self.max_attempts)
+
+    @property
+    def ym_client(self):
+        if self._ym_client is None:
+            self._ym_client = self._timed('yandex market client', self.create_ym_client)
+        return self._ym_client
+
+    @ym_client.setter
+    def ym_client(self, client):
+        self._ym_client = client
+
+    def create_ym_client(self):
+        from client import YandexMarketClient
+
+        return YandexMarketClient(
+            ym_token=self.ym_config['ym_token'],
+            ym_client_id=self.ym_config['ym_client_id'],
+            ym_campaign_id=self.ym_config['campaign_id'],
+            max_attempts=self.max_attempts
+        )
+
+    # Startup profile
+
+    def init_all(self):
+        # Imports are timed apart from initialisation. Modules imported by main.py itself are not included,
+        # use `python -X importtime main.py --help` for them
+        for module_name in LAZY_MODULES:
+            self._timed('import {}'.format(module_name), importlib.import_module, module_name)
+        self.config
+        self.session
+        self.bxb_client
+        self.ym_client
+
+    def startup_report(self) -> str:
+        lines = []
+        for stage, stage_time in self.timings.items():
+            lines.append('{:<24}{:>10.1f} ms'.format(stage, stage_time * 1000))
+        total = sum(self.timings.values())
+        lines.append('{:<24}{:>10.1f} ms'.format('total', total * 1000))
+        return '\n'.join(lines)
+
+
+app = AppContext()
@@ -1,7 +1,51 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-engine = create_engine('sqlite:///yandex_regions.db')
-Session = sessionmaker()
-Session.configure(bind=engine)
-session = Session()
\ No newline at end of file
+DEFAULT_DATABASE_URL = 'sqlite:///yandex_regions.db'
+
+# WAL lets readers work while a batch is written, NORMAL sync is safe with WAL and much faster than FULL
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+
+# Thread-local sessions: every thread gets its own session from the same registry
+Session = scoped_session(sessionmaker())
+
+_engine = None
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {}={}'.format(pragma, value))
+    cursor.close()
+
+
+def get_engine(database_url: str = None):
+    global _engine
+    if _engine is None:
+        database_url = database_url or DEFAULT_DATABASE_URL
+        _engine = create_engine(database_url)
+        if database_url.startswith('sqlite'):
+            event.listen(_engine, 'connect', set_sqlite_pragmas)
+        Session.configure(bind=_engine)
+    return _engine
+
+
+def get_session():
+    get_engine()
+    return Session()
+
+
+def reset_connections():
+    """
+    Forgets sessions and pooled connections inherited by a forked worker process.
+    Nothing is closed or rolled back: the parent process still uses these connections
+    """
+    Session.registry.clear()
+    if _engine is not None:
+        _engine.dispose(close=False)
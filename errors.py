@@ -23,3 +23,18 @@ class ClientError(ServiceException):
 class ClientConnectionError(ServiceException):
     def __init__(self, service: str = 'Service', error_text: str = 'No text'):
         self.message = '{} returned 5xx code. Message: {}'.format(service, error_text)
+
+
+class ClientRateLimitError(ClientConnectionError):
+    def __init__(self, service: str = 'Service', error_text: str = 'No text'):
+        self.message = '{} throttled requests. Message: {}'.format(service, error_text)
+
+
+class ClientNotFoundError(ClientConnectionError):
+    def __init__(self, service: str = 'Service', error_text: str = 'No text'):
+        self.message = '{} returned 404 code. Message: {}'.format(service, error_text)
+
+
+class RegionNotFoundError(ClientError):
+    def __init__(self, city_name: str = 'No city', area_name: str = 'No area'):
+        self.message = 'No region {}, {} was found in Yandex.API'.format(city_name, area_name)
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from logger import logger
+
+
+class AdaptiveLimiter:
+    """
+    AIMD controller of requests of a client: both the number of requests in flight and the request rate
+    grow additively while responses are healthy and are cut multiplicatively on throttling or server errors.
+
+    Use as a context manager around every request and report the outcome with `on_success` or `on_throttle`.
+    Limits are cut at most once per throttling event: failures of requests sent before the last cut are ignored.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_concurrency: int = 4,
+                 initial_rate: float = 1.0,
+                 min_rate: float = 0.1,
+                 max_rate: float = 10.0,
+                 rate_step: float = 0.25,
+                 decrease_factor: float = 0.5,
+                 success_window: int = 20):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.success_window = success_window
+
+        self._concurrency = 1.0
+        self._rate = initial_rate
+        self._in_flight = 0
+        self._successes = 0
+        self._next_send_at = 0.0
+        self._last_cut_at = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self._concurrency)
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def __str__(self):
+        return '{} limits: {} request(s) in flight, {:.2f} requests/s'.format(self.name, self.concurrency_limit,
+                                                                             self._rate)
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.concurrency_limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+            # Reserve the next send slot, so concurrent callers are spread by the current rate
+            send_at = max(time.monotonic(), self._next_send_at)
+            self._next_send_at = send_at + 1 / self._rate
+
+        delay = send_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes < self.success_window:
+                return
+            self._successes = 0
+
+            old_limits = (self.concurrency_limit, self._rate)
+            self._rate = min(self.max_rate, self._rate + self.rate_step)
+            self._concurrency = min(self.max_concurrency, self._concurrency + 1)
+            self._condition.notify_all()
+
+            if old_limits == (self.concurrency_limit, self._rate):
+                return
+        logger.info(msg='Raised {}'.format(self))
+
+    def on_throttle(self, sent_at: float = None):
+        """
+        :param sent_at: `time.monotonic()` when the failed request was sent. Requests in flight during the last cut
+        were sent at the old limits, their failures do not cut the limits again
+        """
+        with self._condition:
+            if sent_at is not None and sent_at < self._last_cut_at:
+                return
+            self._last_cut_at = time.monotonic()
+            self._successes = 0
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+            self._concurrency = max(1.0, self._concurrency * self.decrease_factor)
+            # Everybody waits at least one interval of the new rate before the next request
+            self._next_send_at = max(self._next_send_at, time.monotonic() + 1 / self._rate)
+        logger.warning(msg='Throttled, cut {}'.format(self))
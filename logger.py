@@ -1,11 +1,12 @@
 import logging
 
-from config_parser import general_config
+DEFAULT_LOG_FILE_NAME = 'all_log.log'
 
-filename = general_config.get('log_file_name', None) or 'all_log.log'
-
-logging.basicConfig(filename="all_log.log",
-                    level=logging.INFO,
-                    format='%(asctime)-15s %(levelname)s %(message)s',
-                    filemode='a')
 logger = logging.getLogger('BoxberryParserLog')
+
+
+def setup_logging(filename: str = None):
+    logging.basicConfig(filename=filename or DEFAULT_LOG_FILE_NAME,
+                        level=logging.INFO,
+                        format='%(asctime)-15s %(levelname)s %(message)s',
+                        filemode='a')
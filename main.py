@@ -1,66 +1,91 @@
 import argparse
-import time
-from datetime import date
+import hashlib
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
 from math import ceil
+from multiprocessing import Pool
+from typing import Optional
 
-from db import session
-from errors import PointParseError, ClientError, ClientConnectionError, ConfigError
+from context import app
+from errors import BoxberryError, PointParseError, ClientError, ClientConnectionError, ConfigError, \
+    RegionNotFoundError
 from logger import logger
-from client import BoxberryClient, BoxberryError, YandexMarketClient, convert_region_names_for_yandex
-from config_parser import bxb_config, ym_config, general_config
-from models import YandexRegion, DeliveryCostOverride
+from normalize_dict import convert_region_names_for_yandex
 from phoneparser import parse_phone
+from snapshot import export_snapshot, load_snapshot
 
 
 def get_all_cities(region_names: list, city_names: list) -> list:
     region_city_codes = []
     if region_names:
         try:
-            region_cities = bxb_client.get_cities_of_region(region_names=region_names)
+            region_cities = app.bxb_client.get_cities_of_region(region_names=region_names)
         except BoxberryError as e:
             logger.error(msg='Can not get cities of regions: {}. {}'.format(str(region_names), e))
         else:
             try:
-                region_city_codes = bxb_client.get_cities_codes(region_cities)
+                region_city_codes = app.bxb_client.get_cities_codes(region_cities)
             except BoxberryError as e:
                 logger.error(msg='Can not get city codes of region(s) {}. {}'.format(str(region_names), e))
 
     city_codes = []
     if city_names:
         try:
-            city_codes = bxb_client.get_city_codes(city_names=city_names)
+            city_codes = app.bxb_client.get_city_codes(city_names=city_names)
         except BoxberryError as e:
             logger.error(msg='Can not get city codes of city(es): {}. {}'.format(str(city_names), e))
 
     return region_city_codes + city_codes
 
 
-def get_city_bxb_points(cities_list: list) -> set:
+def get_points_fingerprints(short_points: list) -> dict:
+    """
+    :param short_points: ListPointsShort response
+    :return: {code: fingerprint}. `UpdateDate` if Boxberry returned it, else a hash of the list fields of the point
+    """
+    points_fingerprints = dict()
+    for short_point in short_points:
+        if not short_point.get('Code'):
+            continue
+        fingerprint = short_point.get('UpdateDate')
+        if not fingerprint:
+            fingerprint = hashlib.sha1(json.dumps(short_point, sort_keys=True).encode()).hexdigest()
+        points_fingerprints[short_point['Code']] = fingerprint
+    return points_fingerprints
+
+
+def get_city_bxb_points(cities_list: list) -> dict:
     points = []
     for code in cities_list:
         try:
-            point = bxb_client.get_points_codes_list(code)
+            point = app.bxb_client.get_points_codes_list(code)
         except BoxberryError as e:
             logger.warning(msg='Points for city code {} did not found. {}'.format(code, e))
         else:
             points += point
 
-    points_codes = [point['Code'] for point in points if point.get('Code', None)]
-    return set(points_codes)
+    return get_points_fingerprints(points)
 
 
 def update_rate(rate: int):
-    return ceil(rate) // 10 * 10 + int(bxb_config['picking_fee'])
+    return ceil(rate) // 10 * 10 + int(app.bxb_config['picking_fee'])
 
 
 def get_rate_override(city: str = None, region: str = None):
+    from models import DeliveryCostOverride
+
     if region:
-        override_rate_by_region = session.query(DeliveryCostOverride).filter_by(region_name=region).one_or_none()
+        override_rate_by_region = app.session.query(DeliveryCostOverride).filter_by(
+            region_name=region
+        ).one_or_none()
         if override_rate_by_region:
             return override_rate_by_region
 
     if city:
-        override_rate_by_city = session.query(DeliveryCostOverride).filter_by(city_name=city).one_or_none()
+        override_rate_by_city = app.session.query(DeliveryCostOverride).filter_by(city_name=city).one_or_none()
         if override_rate_by_city:
             return override_rate_by_city
 
@@ -71,62 +96,79 @@ def get_bxb_detailed_points(points_codes: set, exclude: set, target_start: str,
     if exclude:
         digit_exclude_codes = [code.replace('bxb_', '') for code in exclude]
         cleaned_points = set(points_codes) - set(digit_exclude_codes)
-        logger.info(msg='{} points yet exist in Yandex.Market'.format(len(points_codes) - len(cleaned_points)))
+        logger.info(msg='{} points skipped: exist in Yandex.Market or quarantined'.format(
+            len(points_codes) - len(cleaned_points)))
     else:
         cleaned_points = points_codes
+    cleaned_points = list(cleaned_points)
 
     points_detailed_dict = dict()
 
     logger.info(msg='Begin to get detailed info about {} points'.format(len(cleaned_points)))
-    for point_code in cleaned_points:
-        try:
-            detailed_point = bxb_client.get_point_info(point_code=point_code)
-            time.sleep(1)
+    # Boxberry limiter decides how many of the workers may have a request in flight at once
+    with ThreadPoolExecutor(max_workers=app.bxb_client.limiter.max_concurrency) as executor:
+        detailed_points = executor.map(
+            lambda point_code: get_bxb_detailed_point(point_code, target_start, default_weight),
+            cleaned_points
+        )
+        for point_code, detailed_point in zip(cleaned_points, detailed_points):
+            if detailed_point:
+                points_detailed_dict['bxb_{}'.format(point_code)] = detailed_point
+
+    logger.info(msg='Got {} points from Boxberry. {}'.format(len(points_detailed_dict), app.bxb_client.limiter))
+    return points_detailed_dict
 
-            override_rate = get_rate_override(city=detailed_point.get('CityName'), region=detailed_point.get('Area'))
 
-            point_delivery_info = bxb_client.get_point_rate(
-                point_code=point_code,
-                default_weight=default_weight,
-                target_start=target_start
-            )
+def get_bxb_detailed_point(point_code: str, target_start: str, default_weight: int) -> Optional[dict]:
+    try:
+        detailed_point = app.bxb_client.get_point_info(point_code=point_code)
 
-            for field in ('price', 'delivery_period'):
-                if point_delivery_info.get(field, False) == False:
-                    raise PointParseError(
-                        'bxb did not return field {} for point {}. Point skipped'.format(field, point_code)
-                    )
+        override_rate = get_rate_override(city=detailed_point.get('CityName'), region=detailed_point.get('Area'))
 
-            if not override_rate:
-                point_final_rate = update_rate(point_delivery_info.get('price'))
-            else:
-                point_final_rate = override_rate.rate
-            min_delivery_days = int(point_delivery_info.get('delivery_period')) + int(bxb_config.get('picking_time', 0))
-            max_delivery_days = min_delivery_days + int(bxb_config.get('delivery_window', 0))
-            time.sleep(1)
-
-            detailed_point.update({
-                'rate': point_final_rate,
-                'min_delivery_days': min_delivery_days,
-                'max_delivery_days': max_delivery_days
-            })
+        point_delivery_info = app.bxb_client.get_point_rate(
+            point_code=point_code,
+            default_weight=default_weight,
+            target_start=target_start
+        )
 
-        except BoxberryError as e:
-            logger.warning(msg='Detailed info about point {} did not found. {}'.format(point_code, e))
-        except PointParseError as e:
-            logger.warning(msg=e)
-        else:
-            points_detailed_dict['bxb_{}'.format(point_code)] = detailed_point
+        for field in ('price', 'delivery_period'):
+            if point_delivery_info.get(field, False) == False:
+                raise PointParseError(
+                    'bxb did not return field {} for point {}. Point skipped'.format(field, point_code)
+                )
 
-    logger.info(msg='Got {} points from Boxberry'.format(len(points_detailed_dict)))
-    return points_detailed_dict
+        if not override_rate:
+            point_final_rate = update_rate(point_delivery_info.get('price'))
+        else:
+            point_final_rate = override_rate.rate
+        min_delivery_days = (int(point_delivery_info.get('delivery_period')) +
+                             int(app.bxb_config.get('picking_time', 0)))
+        max_delivery_days = min_delivery_days + int(app.bxb_config.get('delivery_window', 0))
+
+        detailed_point.update({
+            'rate': point_final_rate,
+            'min_delivery_days': min_delivery_days,
+            'max_delivery_days': max_delivery_days
+        })
+
+    except BoxberryError as e:
+        logger.warning(msg='Detailed info about point {} did not found. {}'.format(point_code, e))
+    except PointParseError as e:
+        logger.warning(msg=e)
+    except ClientConnectionError as e:
+        # Retries are exhausted: the point is counted as failed and quarantined, the run goes on
+        logger.error(msg='Can not get detailed info about point {}. {}'.format(point_code, e))
+    else:
+        return detailed_point
 
 
 def get_yandex_region_id_from_db(ready_for_yandex_point) -> int:
+    from models import YandexRegion
+
     city_name = ready_for_yandex_point.get('CityName')
     region_name = ready_for_yandex_point.get('Area')
 
-    region = session.query(YandexRegion).filter_by(
+    region = app.session.query(YandexRegion).filter_by(
         city_name=city_name,
         region=region_name
     ).one_or_none()
@@ -137,6 +179,41 @@ def get_yandex_region_id_from_db(ready_for_yandex_point) -> int:
     return region.yandex_id
 
 
+SCHEDULE_DAYS = (
+    ('WorkMoBegin', 'WorkMoEnd', 'MONDAY',),
+    ('WorkTuBegin', 'WorkTuEnd', 'TUESDAY',),
+    ('WorkWeBegin', 'WorkWeEnd', 'WEDNESDAY',),
+    ('WorkThBegin', 'WorkThEnd', 'THURSDAY',),
+    ('WorkFrBegin', 'WorkFrEnd', 'FRIDAY',),
+    ('WorkSaBegin', 'WorkSaEnd', 'SATURDAY',),
+    ('WorkSuBegin', 'WorkSuEnd', 'SUNDAY'),
+)
+SCHEDULE_FIELDS = tuple(field for begin, end, ym_key in SCHEDULE_DAYS for field in (begin, end))
+
+
+@lru_cache(maxsize=1024)
+def get_schedule_items(schedule_values: tuple) -> list:
+    """
+    :param schedule_values: values of SCHEDULE_FIELDS of a point
+    :return: Yandex schedule items. Points with identical schedules share the same list, it must not be modified
+    """
+    schedule = []
+
+    for day_number, (begin, end, ym_key) in enumerate(SCHEDULE_DAYS):
+        begin_time, end_time = schedule_values[day_number * 2], schedule_values[day_number * 2 + 1]
+        if begin_time and end_time:
+            schedule.append(
+                {
+                    'startDay': ym_key,
+                    'endDay': ym_key,
+                    'startTime': begin_time,
+                    'endTime': end_time
+                }
+            )
+
+    return schedule
+
+
 def convert_bxb_to_ym(bxb_code: str, bxb_point: dict, emails: list) -> dict:
     name = bxb_point.get('Name')
     address = bxb_point.get('Address')
@@ -146,33 +223,14 @@ def convert_bxb_to_ym(bxb_code: str, bxb_point: dict, emails: list) -> dict:
     max_delivery_days = bxb_point.get('max_delivery_days')
 
     ready_for_yandex_point = convert_region_names_for_yandex(bxb_point)
-    region_id = get_yandex_region_id_from_db(ready_for_yandex_point)
+    # Points loaded from a snapshot carry the region id resolved when the snapshot was made
+    region_id = bxb_point.get('yandex_region_id') or get_yandex_region_id_from_db(ready_for_yandex_point)
 
     fixed_phone = ''
     if phone:
         fixed_phone = parse_phone(phone)
 
-    schedule_fields = (
-        ('WorkMoBegin', 'WorkMoEnd', 'MONDAY',),
-        ('WorkTuBegin', 'WorkTuEnd', 'TUESDAY',),
-        ('WorkWeBegin', 'WorkWeEnd', 'WEDNESDAY',),
-        ('WorkThBegin', 'WorkThEnd', 'THURSDAY',),
-        ('WorkFrBegin', 'WorkFrEnd', 'FRIDAY',),
-        ('WorkSaBegin', 'WorkSaEnd', 'SATURDAY',),
-        ('WorkSuBegin', 'WorkSuEnd', 'SUNDAY'),
-    )
-    schedule = []
-
-    for begin, end, ym_key in schedule_fields:
-        if bxb_point.get(begin, False) and bxb_point.get(end, False):
-            schedule.append(
-                {
-                    'startDay': ym_key,
-                    'endDay': ym_key,
-                    'startTime': bxb_point.get(begin),
-                    'endTime': bxb_point.get(end)
-                }
-            )
+    schedule = get_schedule_items(tuple(bxb_point.get(field) for field in SCHEDULE_FIELDS))
 
     return {
         'name': name,
@@ -208,42 +266,81 @@ def convert_bxb_to_ym(bxb_code: str, bxb_point: dict, emails: list) -> dict:
 
 
 def delete_all_boxberry_points():
-    existing_ym_codes = ym_client.get_outlets_by_type(outlet_type='bxb')
+    existing_ym_codes = app.ym_client.get_outlets_by_type(outlet_type='bxb')
     for existing_code, existing_outlet in existing_ym_codes.items():
-        ym_client.delete_outlet(existing_outlet.get('id'))
+        app.ym_client.delete_outlet(existing_outlet.get('id'))
+
+
+def update_regions_db(batch_size: int = 500):
+    from models import YandexRegion, UnresolvedRegion
 
+    app.session  # Creates tables on the first run
+    region_ttl = timedelta(days=int(app.ym_config.get('region_ttl_days', 1)))
+    unresolved_region_ttl = timedelta(days=int(app.ym_config.get('unresolved_region_ttl_days', 7)))
 
-def update_regions_db():
-    all_points = bxb_client.get_points_list()
+    all_points = app.bxb_client.get_points_list()
+    updated_dates = YandexRegion.get_updated_dates()
+    unresolved_dates = UnresolvedRegion.get_checked_dates()
+    today = date.today()
 
-    for point in all_points:
-        point = convert_region_names_for_yandex(point)
-        city_name = point.get('CityName')
-        region = point.get('Area')
+    checked_regions = set()
+    resolved_keys = set()
+    resolved_regions = []
+    unresolved_regions = []
 
-        city_instance = session.query(YandexRegion).filter_by(city_name=city_name, region=region).one_or_none()
+    try:
+        for point in all_points:
+            point = convert_region_names_for_yandex(point)
+            city_name = point.get('CityName')
+            region = point.get('Area')
+            region_key = (city_name, region)
+
+            if region_key in checked_regions:
+                continue
+            checked_regions.add(region_key)
+
+            if region_key in updated_dates and today - updated_dates[region_key] < region_ttl:
+                continue
+            if region_key in unresolved_dates and today - unresolved_dates[region_key] < unresolved_region_ttl:
+                continue
 
-        if not city_instance or city_instance.updated != date.today():
             try:
-                region_id = ym_client.get_region_id(point)
+                region_id = app.ym_client.get_region_id(point)
+            except RegionNotFoundError as e:
+                logger.warning(msg='{}. Skipped for {} days'.format(e, unresolved_region_ttl.days))
+                unresolved_regions.append({'city_name': city_name, 'region': region, 'checked': today})
+                continue
             except ClientError:
                 continue
-            else:
-                YandexRegion.create_or_update(city_name=city_name,
-                                              yandex_id=region_id,
-                                              region=region)
+            except ClientConnectionError as e:
+                # Yandex kept throttling or failing, the city is requested again on the next run
+                logger.error(msg='Can not get region id for {}, {}: {}'.format(city_name, region, e))
+                continue
+
+            resolved_keys.add(region_key)
+            resolved_regions.append({'city_name': city_name, 'region': region, 'yandex_id': region_id,
+                                     'updated': today})
+            if len(resolved_regions) >= batch_size:
+                YandexRegion.bulk_upsert(resolved_regions, batch_size=batch_size)
+                resolved_regions = []
+    finally:
+        # Rows resolved so far are kept even if the run is aborted
+        YandexRegion.bulk_upsert(resolved_regions, batch_size=batch_size)
+        UnresolvedRegion.bulk_upsert(unresolved_regions, batch_size=batch_size)
+        # Cities resolved after their negative entry expired
+        UnresolvedRegion.forget({region_key for region_key in unresolved_dates if region_key in resolved_keys})
 
 
 def delete_missing_outlets(existing_ym_codes, points_from_bxb_response):
     # Remove points from YandexMarket if not found on Boxberry
-    prefixed_points_codes = ['bxb_{}'.format(point_code) for point_code in points_from_bxb_response]
+    prefixed_points_codes = {'bxb_{}'.format(point_code) for point_code in points_from_bxb_response}
     removed_points_count = 0
 
     for code, outlet in existing_ym_codes.items():
         if code not in prefixed_points_codes:
             try:
-                ym_client.delete_outlet(outlet.get('id'))
-            except ClientError or ClientConnectionError as e:
+                app.ym_client.delete_outlet(outlet.get('id'))
+            except (ClientError, ClientConnectionError) as e:
                 logger.error(msg='Can not delete Boxberry point from Yandex.Market: {}'.format(e))
             else:
                 removed_points_count += 1
@@ -253,8 +350,12 @@ def delete_missing_outlets(existing_ym_codes, points_from_bxb_response):
     logger.info(msg='Removed {} outlets from Yandex.Market'.format(removed_points_count))
 
 
-def update_existing_outlets(existing_ym_codes, active_boxberry_points, emails):
+def update_existing_outlets(existing_ym_codes, active_boxberry_points, emails) -> set:
+    """
+    :return: codes of points which could not be updated
+    """
     updated_outlets_count = 0
+    failed_codes = set()
 
     for bxb_point_code, bxb_point in active_boxberry_points.items():
         if bxb_point_code in existing_ym_codes.keys():
@@ -263,12 +364,13 @@ def update_existing_outlets(existing_ym_codes, active_boxberry_points, emails):
                 updated_point_data = convert_bxb_to_ym(bxb_point_code, bxb_point, emails)
             except PointParseError as e:
                 logger.error(msg='Can not convert point data: {}'.format(e))
+                failed_codes.add(bxb_point_code)
                 continue
             try:
-                ym_client.update_outlet(existing_ym_codes[bxb_point_code].get('id'), updated_point_data)
-                time.sleep(1)
-            except ClientError or ClientConnectionError as e:
+                app.ym_client.update_outlet(existing_ym_codes[bxb_point_code].get('id'), updated_point_data)
+            except (ClientError, ClientConnectionError) as e:
                 logger.error(msg='Can not update Boxberry point on Yandex.Market: {}'.format(e))
+                failed_codes.add(bxb_point_code)
             else:
                 updated_outlets_count += 1
                 logger.info(msg='Point id: {}, address: {} was updated on Yandex.Market'.format(bxb_point_code,
@@ -276,10 +378,15 @@ def update_existing_outlets(existing_ym_codes, active_boxberry_points, emails):
                                                                                                     'Address')))
 
     logger.info(msg='Updated {} outlets on Yandex.Market'.format(updated_outlets_count))
+    return failed_codes
 
 
-def add_new_outlets(existing_ym_codes, active_boxberry_points, emails):
+def add_new_outlets(existing_ym_codes, active_boxberry_points, emails) -> set:
+    """
+    :return: codes of points which could not be added
+    """
     added_outlets_count = 0
+    failed_codes = set()
 
     for bxb_point_code, bxb_point in active_boxberry_points.items():
         if bxb_point_code not in existing_ym_codes.keys():
@@ -287,37 +394,157 @@ def add_new_outlets(existing_ym_codes, active_boxberry_points, emails):
                 new_point = convert_bxb_to_ym(bxb_point_code, bxb_point, emails)
             except PointParseError as e:
                 logger.error(msg='Can not convert point data: {}'.format(e))
+                failed_codes.add(bxb_point_code)
                 continue
 
             try:
-                ym_client.post_outlet(new_point)
-                time.sleep(1)
-            except ClientError or ClientConnectionError as e:
+                app.ym_client.post_outlet(new_point)
+            except (ClientError, ClientConnectionError) as e:
                 logger.error(msg='Can not add Boxberry point to Yandex.Market: {}'.format(e))
+                failed_codes.add(bxb_point_code)
             else:
                 added_outlets_count += 1
                 logger.info(msg='New point id: {}, address: {} was added to Yandex.Market'.format(bxb_point_code,
                                                                                                   bxb_point.get(
                                                                                                       'Address')))
     logger.info(msg='Added {} outlets to Yandex.Market'.format(added_outlets_count))
+    logger.info(msg=str(app.ym_client.limiter))
+    return failed_codes
 
 
-# Setup clients
+def split_into_shards(points_codes: set, shards_count: int) -> list:
+    # crc32 is stable between processes and runs, unlike built-in hash() of str
+    shards = [set() for _ in range(shards_count)]
+    for point_code in points_codes:
+        shards[zlib.crc32(str(point_code).encode()) % shards_count].add(point_code)
+    return shards
 
-bxb_client = BoxberryClient(token=bxb_config['boxberry_token'])
-ym_client = YandexMarketClient(
-    ym_token=ym_config['ym_token'],
-    ym_client_id=ym_config['ym_client_id'],
-    ym_campaign_id=ym_config['campaign_id']
-)
 
+def get_shard_detailed_points(bxb_token: str, points_codes: set, exclude: set, target_start: str,
+                              default_weight: int) -> dict:
+    # Runs in a worker process: every shard uses its own Boxberry session and its own token
+    app.bxb_client = app.create_bxb_client(token=bxb_token)
+    # Do not reuse SQLite connections inherited from the parent process
+    app.reset_db()
+
+    return get_bxb_detailed_points(
+        points_codes=points_codes,
+        exclude=exclude,
+        target_start=target_start,
+        default_weight=default_weight
+    )
+
+
+def get_bxb_detailed_points_sharded(points_codes: set, exclude: set, target_start: str, default_weight: int,
+                                    workers: int) -> dict:
+    """
+    :param workers: number of processes, at most the number of Boxberry tokens: every shard uses its own token
+    """
+    bxb_tokens = app.bxb_tokens
+    shards = [shard for shard in split_into_shards(points_codes, workers) if shard]
+    logger.info(msg='Split {} points into {} shards, {} Boxberry token(s) available'.format(len(points_codes),
+                                                                                        len(shards),
+                                                                                        len(bxb_tokens)))
+
+    shard_args = [
+        (bxb_tokens[shard_number], shard, exclude, target_start, default_weight)
+        for shard_number, shard in enumerate(shards)
+    ]
+
+    points_detailed_dict = dict()
+    with Pool(processes=len(shards) or 1) as pool:
+        for shard_points in pool.starmap(get_shard_detailed_points, shard_args):
+            points_detailed_dict.update(shard_points)
+
+    logger.info(msg='Got {} points from Boxberry in {} shards'.format(len(points_detailed_dict), len(shards)))
+    return points_detailed_dict
+
+
+def add_region_ids(detailed_points: dict) -> dict:
+    # Resolved region ids are kept with the points, so a snapshot can be pushed without the local db
+    for point in detailed_points.values():
+        try:
+            point['yandex_region_id'] = get_yandex_region_id_from_db(convert_region_names_for_yandex(dict(point)))
+        except PointParseError:
+            point['yandex_region_id'] = None
+    return detailed_points
+
+
+def get_points_to_skip(points_fingerprints: dict, existing_ym_codes: dict) -> set:
+    """
+    Points which are not fetched: unchanged points already on Yandex.Market and points in quarantine,
+    i.e. unchanged points which failed recently. Unchanged failed points are fetched again once `retry_after` comes,
+    published or not
+    :return: prefixed codes, like `existing_ym_codes`
+    """
+    from models import PointState
+
+    app.session  # Creates tables on the first run
+    states = PointState.get_states()
+    today = date.today()
+    skip = set()
+
+    for code, fingerprint in points_fingerprints.items():
+        prefixed_code = 'bxb_{}'.format(code)
+        state = states.get(code)
+        unchanged = state is not None and state.fingerprint == fingerprint
+        failed = state is not None and bool(state.failures)
+        quarantined = failed and state.retry_after is not None and state.retry_after > today
+
+        if prefixed_code in existing_ym_codes:
+            # Points published before fingerprints were stored are taken as unchanged
+            if state is None or (unchanged and (not failed or quarantined)):
+                skip.add(prefixed_code)
+        elif unchanged and quarantined:
+            skip.add(prefixed_code)
+
+    changed_count = len([code for code in points_fingerprints if 'bxb_{}'.format(code) in existing_ym_codes and
+                         'bxb_{}'.format(code) not in skip])
+    logger.info(msg='{} points are skipped as unchanged or in quarantine, '
+                    '{} published points changed or retried'.format(len(skip), changed_count))
+    return skip
+
+
+def save_points_states(points_fingerprints: dict, fetched_codes: set, failed_codes: set):
+    """
+    Stores fingerprints of all points. Failed points are quarantined for 1, 2, 4... days up to `max_quarantine_days`
+    """
+    from models import PointState
+
+    states = PointState.get_states()
+    today = date.today()
+    max_quarantine_days = int(app.general_config.get('max_quarantine_days', 30))
+    rows = []
+
+    for code, fingerprint in points_fingerprints.items():
+        state = states.get(code)
+        row = {'code': code, 'fingerprint': fingerprint, 'failures': 0, 'retry_after': None, 'updated': today}
+
+        if code in failed_codes:
+            failures = state.failures + 1 if state is not None and state.fingerprint == fingerprint else 1
+            row.update({
+                'failures': failures,
+                'retry_after': today + timedelta(days=min(2 ** (failures - 1), max_quarantine_days))
+            })
+        elif code not in fetched_codes and state is not None:
+            row.update({'failures': state.failures, 'retry_after': state.retry_after})
 
-def run(update_existing: bool, run_update_db: bool):
-    region_names = bxb_config.get('region_names')
+        rows.append(row)
+
+    PointState.bulk_upsert(rows)
+    PointState.delete_codes(set(states) - set(points_fingerprints))
+    logger.info(msg='Saved states of {} points, {} failed'.format(len(rows), len(failed_codes)))
+
+
+def fetch_bxb_points(existing_ym_codes: dict, update_existing: bool, workers: int = None) -> (dict, dict, set):
+    """
+    :return: {code: fingerprint} of all points from Boxberry response, detailed points and codes of fetched points
+    """
+    region_names = app.bxb_config.get('region_names')
     if region_names:
         region_names = region_names.split(',')
 
-    city_names = bxb_config.get('city_names')
+    city_names = app.bxb_config.get('city_names')
     if city_names:
         city_names = city_names.split(',')
 
@@ -325,43 +552,106 @@ def run(update_existing: bool, run_update_db: bool):
         raise ConfigError('region_names or city_names definition required in config')
 
     try:
-        emails = general_config['emails'].split(',')
-        target_start = bxb_config['target_start']
-        default_weight = bxb_config['default_weight']
+        target_start = app.bxb_config['target_start']
+        default_weight = app.bxb_config['default_weight']
     except KeyError as e:
         raise ConfigError('{} definition required in config'.format(str(e)))
 
-    if run_update_db:
-        update_regions_db()
+    if workers is None:
+        workers = int(app.general_config.get('workers', 1))
+    if workers < 1:
+        raise ConfigError('workers should be a positive number')
+    bxb_tokens_count = len(app.bxb_tokens)
+    if workers > bxb_tokens_count:
+        # Boxberry allows 2 parallel requests per token, processes sharing a token would exceed it
+        logger.warning(msg='{} workers requested, but only {} Boxberry token(s) configured. '
+                           'Using {} worker(s)'.format(workers, bxb_tokens_count, bxb_tokens_count))
+        workers = bxb_tokens_count
 
-    existing_ym_codes = ym_client.get_outlets_by_type(outlet_type='bxb')
-    logger.info(msg='Got {} existing Boxberry points from Yandex.Market'.format(len(existing_ym_codes)))
+    if region_names == ['all']:
+        points_from_bxb_response = get_points_fingerprints(app.bxb_client.get_points_codes_list())
+    else:
+        points_from_bxb_response = get_city_bxb_points(get_all_cities(region_names, city_names))
 
     if update_existing:
         exclude = set()
     else:
-        exclude = set(existing_ym_codes.keys())
-
-    if region_names == ['all']:
-        points_from_bxb_response = {point.get('Code') for point in bxb_client.get_points_codes_list() if point.get('Code')}
+        exclude = get_points_to_skip(points_from_bxb_response, existing_ym_codes)
+
+    if workers > 1:
+        active_boxberry_points = get_bxb_detailed_points_sharded(
+            points_codes=points_from_bxb_response,
+            exclude=exclude,
+            target_start=target_start,
+            default_weight=default_weight,
+            workers=workers
+        )
     else:
-        points_from_bxb_response = get_city_bxb_points(get_all_cities(region_names, city_names))
+        active_boxberry_points = get_bxb_detailed_points(
+            points_codes=points_from_bxb_response,
+            exclude=exclude,
+            target_start=target_start,
+            default_weight=default_weight
+        )
+
+    fetched_codes = {code for code in points_from_bxb_response if 'bxb_{}'.format(code) not in exclude}
+    return points_from_bxb_response, active_boxberry_points, fetched_codes
+
+
+def load_bxb_points(snapshot_file_name: str) -> (set, dict):
+    """
+    Like a live run, points detailed in the snapshot are added if missing on Yandex.Market and updated if published:
+    a snapshot of a run without --force-update holds exactly the new and changed points
+    """
+    points_from_bxb_response, active_boxberry_points = load_snapshot(snapshot_file_name)
+    logger.info(msg='Loaded {} of {} points from snapshot {}'.format(len(active_boxberry_points),
+                                                                     len(points_from_bxb_response),
+                                                                     snapshot_file_name))
+    return points_from_bxb_response, active_boxberry_points
+
+
+def run(update_existing: bool, run_update_db: bool, workers: int = None, export_snapshot_file_name: str = None,
+        from_snapshot_file_name: str = None):
+    try:
+        emails = app.general_config['emails'].split(',')
+    except KeyError as e:
+        raise ConfigError('{} definition required in config'.format(str(e)))
 
-    active_boxberry_points = get_bxb_detailed_points(
-        points_codes=points_from_bxb_response,
-        exclude=exclude,
-        target_start=target_start,
-        default_weight=default_weight
-    )
+    if run_update_db:
+        if from_snapshot_file_name:
+            logger.warning(msg='Regions db is not updated for a run from snapshot')
+        else:
+            update_regions_db()
 
+    existing_ym_codes = app.ym_client.get_outlets_by_type(outlet_type='bxb')
+    logger.info(msg='Got {} existing Boxberry points from Yandex.Market'.format(len(existing_ym_codes)))
+
+    if from_snapshot_file_name:
+        points_from_bxb_response, active_boxberry_points = load_bxb_points(from_snapshot_file_name)
+        fetched_codes = None
+    else:
+        points_from_bxb_response, active_boxberry_points, fetched_codes = fetch_bxb_points(existing_ym_codes,
+                                                                                           update_existing, workers)
+        if export_snapshot_file_name:
+            export_snapshot(export_snapshot_file_name, points_from_bxb_response, add_region_ids(active_boxberry_points))
+            logger.info(msg='Saved {} points to snapshot {}'.format(len(active_boxberry_points),
+                                                                    export_snapshot_file_name))
+
+    # Delete phase always sees the global point set, not a single shard
     delete_missing_outlets(existing_ym_codes, points_from_bxb_response)
 
-    if update_existing:
-        # Update existing points (outlets) on Yandex
-        update_existing_outlets(existing_ym_codes, active_boxberry_points, emails)
+    # Update existing points (outlets) on Yandex. Without --force-update only changed points were fetched
+    failed_codes = update_existing_outlets(existing_ym_codes, active_boxberry_points, emails)
 
     # Add new found points (outlets) to Yandex
-    add_new_outlets(existing_ym_codes, active_boxberry_points, emails)
+    failed_codes |= add_new_outlets(existing_ym_codes, active_boxberry_points, emails)
+
+    if fetched_codes is not None:
+        # Points which Boxberry did not describe, and points Yandex did not accept
+        failed_codes = {code.replace('bxb_', '') for code in failed_codes} | {
+            code for code in fetched_codes if 'bxb_{}'.format(code) not in active_boxberry_points
+        }
+        save_points_states(points_from_bxb_response, fetched_codes, failed_codes)
 
 
 if __name__ == '__main__':
@@ -383,6 +673,40 @@ if __name__ == '__main__':
         help='Updates local db of Yandex region ids. Default: False'
     )
 
+    bb_arg_parser.add_argument(
+        "--profile-startup",
+        action='store_true',
+        help='Initialises config, database and clients, reports the time it took and exits. Default: False'
+    )
+
+    bb_arg_parser.add_argument(
+        '-W',
+        "--workers",
+        type=int,
+        default=None,
+        help='Number of worker processes to fetch Boxberry points with. Default: `workers` from config or 1'
+    )
+
+    bb_arg_parser.add_argument(
+        "--export-snapshot",
+        metavar='FILE',
+        help='Saves points fetched from Boxberry to a gzipped JSON lines snapshot. '
+             'Use with --force-update to save the full catalog'
+    )
+
+    bb_arg_parser.add_argument(
+        "--from-snapshot",
+        metavar='FILE',
+        help='Pushes points from a snapshot to Yandex.Market instead of fetching them from Boxberry'
+    )
+
     args = bb_arg_parser.parse_args()
 
-    run(args.force_update, args.update_regions)
+    if args.profile_startup:
+        app.init_all()
+        startup_report = app.startup_report()
+        logger.info(msg='Startup profile:\n{}'.format(startup_report))
+        print(startup_report)
+        raise SystemExit(0)
+
+    run(args.force_update, args.update_regions, args.workers, args.export_snapshot, args.from_snapshot)
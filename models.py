@@ -1,15 +1,46 @@
 from datetime import date
 
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, Integer, String, Date, Index, inspect, text
 
-from db import session, engine
+from db import get_engine, get_session
 
 Base = declarative_base()
 
 
-class YandexRegion(Base):
+class BulkUpsertMixin:
+    """
+    Adds `INSERT ... ON CONFLICT DO UPDATE` in batches.
+    `__upsert_index__` should name the columns of a unique index of the table.
+    """
+    __upsert_index__ = ()
+
+    @classmethod
+    def bulk_upsert(cls, rows: list, batch_size: int = 500):
+        if not rows:
+            return
+
+        session = get_session()
+        statement = sqlite_insert(cls.__table__)
+        update_columns = [column for column in rows[0].keys() if column not in cls.__upsert_index__]
+        statement = statement.on_conflict_do_update(
+            index_elements=list(cls.__upsert_index__),
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+
+        for batch_start in range(0, len(rows), batch_size):
+            # Executemany of one statement, so the batch size is not limited by the number of SQLite variables
+            session.execute(statement, rows[batch_start:batch_start + batch_size])
+            session.commit()
+
+
+class YandexRegion(BulkUpsertMixin, Base):
     __tablename__ = 'yandex_regions'
+    __table_args__ = (
+        Index('ix_yandex_regions_city_name_region', 'city_name', 'region', unique=True),
+    )
+    __upsert_index__ = ('city_name', 'region')
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     city_name = Column(String)
@@ -22,14 +53,97 @@ class YandexRegion(Base):
 
     @classmethod
     def create_or_update(cls, region, yandex_id, city_name):
-        instance = session.query(cls).filter_by(city_name=city_name, region=region).first()
-        today = date.today()
-        if instance:
-            instance.yandex_id = yandex_id
-            instance.updated = today
-        else:
-            instance = cls(city_name=city_name, yandex_id=yandex_id, region=region, updated=today)
-        session.add(instance)
+        cls.bulk_upsert([{'city_name': city_name, 'region': region, 'yandex_id': yandex_id, 'updated': date.today()}])
+
+    @classmethod
+    def get_updated_dates(cls) -> dict:
+        """
+        :return: {(city_name, region): updated} for all stored regions
+        """
+        session = get_session()
+        return {(city_name, region): updated for city_name, region, updated in
+                session.query(cls.city_name, cls.region, cls.updated)}
+
+
+class UnresolvedRegion(BulkUpsertMixin, Base):
+    """
+    Cities which Yandex could not resolve to a region id, skipped until `unresolved_region_ttl_days` pass
+    """
+    __tablename__ = 'unresolved_regions'
+    __table_args__ = (
+        Index('ix_unresolved_regions_city_name_region', 'city_name', 'region', unique=True),
+    )
+    __upsert_index__ = ('city_name', 'region')
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    city_name = Column(String)
+    region = Column(String)
+    checked = Column(Date)
+
+    def __repr__(self):
+        return self.city_name
+
+    @classmethod
+    def get_checked_dates(cls) -> dict:
+        """
+        :return: {(city_name, region): checked} for all unresolved regions
+        """
+        session = get_session()
+        return {(city_name, region): checked for city_name, region, checked in
+                session.query(cls.city_name, cls.region, cls.checked)}
+
+    @classmethod
+    def forget(cls, regions: set):
+        """
+        :param regions: {(city_name, region)} which were resolved
+        """
+        if not regions:
+            return
+        session = get_session()
+        for city_name, region in regions:
+            session.query(cls).filter_by(city_name=city_name, region=region).delete()
+        session.commit()
+
+
+class PointState(BulkUpsertMixin, Base):
+    """
+    Boxberry point as seen by the last run: fingerprint of its list data and failures to fetch or push it
+    """
+    __tablename__ = 'point_states'
+    __table_args__ = (
+        Index('ix_point_states_code', 'code', unique=True),
+    )
+    __upsert_index__ = ('code',)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String)
+    fingerprint = Column(String)
+    failures = Column(Integer, default=0)
+    retry_after = Column(Date)
+    updated = Column(Date)
+
+    def __repr__(self):
+        return self.code
+
+    @classmethod
+    def get_states(cls) -> dict:
+        """
+        :return: {code: point state row} for all stored points
+        """
+        session = get_session()
+        return {state.code: state for state in
+                session.query(cls.code, cls.fingerprint, cls.failures, cls.retry_after, cls.updated)}
+
+    @classmethod
+    def delete_codes(cls, codes: set, batch_size: int = 500):
+        codes = list(codes)
+        if not codes:
+            return
+        session = get_session()
+        for batch_start in range(0, len(codes), batch_size):
+            session.query(cls).filter(cls.code.in_(codes[batch_start:batch_start + batch_size])).delete(
+                synchronize_session=False
+            )
         session.commit()
 
 
@@ -42,4 +156,26 @@ class DeliveryCostOverride(Base):
     rate = Column(Integer)
 
 
-Base.metadata.create_all(engine)
+def create_missing_indexes(engine):
+    # Tables created by older versions lack indexes added later. Before a unique index is added,
+    # duplicates are dropped keeping the latest row
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            with engine.begin() as connection:
+                if index.unique:
+                    columns = ', '.join(column.name for column in index.columns)
+                    connection.execute(text(
+                        'DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {columns})'.format(
+                            table=table.name, columns=columns)
+                    ))
+                index.create(bind=connection)
+
+
+def create_tables():
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    create_missing_indexes(engine)
@@ -24,4 +24,23 @@ REGULAR_NORMALIZE = OrderedDict(
         (' АО', ' автономный округ'),
         (' - ', ' — ')
     )
-)
\ No newline at end of file
+)
+
+
+def convert_region_names_for_yandex(point):
+    area = point.get('Area')
+    strong_normalized = False
+    for item, replacement in STRONG_NORMALIZE.items():
+        if item in area:
+            area = area.replace(item, replacement)
+            strong_normalized = True
+
+    if not strong_normalized:
+        if 'Респ' in area:
+            area = 'Республика {}'.format(area)
+        for item, replacement in REGULAR_NORMALIZE.items():
+            area = area.replace(item, replacement)
+
+    point['Area'] = area
+
+    return point
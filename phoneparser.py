@@ -1,22 +1,21 @@
+from functools import lru_cache
+
 from errors import PointParseError
 
+TRIM_SYMBOLS = str.maketrans('', '', ')(- ')
+
 
-def parse_phone(raw_phone: str):
-    phone = list(raw_phone)
-    trim = (')', '(', '-', ' ')
-    for symbol in trim:
-        while symbol in phone:
-            phone.remove(symbol)
+@lru_cache(maxsize=4096)
+def parse_phone(raw_phone: str) -> str:
+    # Call-center numbers repeat across hundreds of points, so parsed phones are memoized
+    phone = raw_phone.translate(TRIM_SYMBOLS)
 
-    if phone[0] != '+':
-        if phone[0] == '8':
-            phone[0] = '7'
-        phone = ['+'] + phone
+    if phone[:1] != '+':
+        if phone[:1] == '8':
+            phone = '7' + phone[1:]
+        phone = '+' + phone
 
     if len(phone) != 12:
         raise PointParseError('invalid phone: {}'.format(raw_phone))
 
-    phone = ''.join(phone)
-
     return '{} ({}) {}-{}-{}'.format(phone[:2], phone[2:5], phone[5:8], phone[8:10], phone[10:12])
-
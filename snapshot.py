@@ -0,0 +1,109 @@
+"""
+Snapshots of the Boxberry catalog fetched by a run: gzip-compressed JSON lines.
+
+The first line holds metadata and codes of all points Boxberry returned, every next line holds one detailed point
+(with rate, delivery days and resolved Yandex region id). Files are read line by line, so loading and diffing
+do not need the whole file in memory.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+SNAPSHOT_VERSION = 1
+
+
+def export_snapshot(file_name: str, points_codes: set, detailed_points: dict):
+    """
+    :param points_codes: codes of all points from Boxberry response
+    :param detailed_points: {'bxb_<code>': detailed point}
+    """
+    with gzip.open(file_name, 'wt', encoding='utf-8') as snapshot_file:
+        meta = {
+            'type': 'meta',
+            'version': SNAPSHOT_VERSION,
+            'created': datetime.now().isoformat(),
+            'points_codes': sorted(points_codes),
+        }
+        snapshot_file.write(json.dumps(meta, ensure_ascii=False) + '\n')
+        for code, point in detailed_points.items():
+            snapshot_file.write(json.dumps({'type': 'point', 'code': code, 'point': point}, ensure_ascii=False) + '\n')
+
+
+def iter_snapshot(file_name: str):
+    """
+    Yields snapshot records one by one, metadata first
+    """
+    with gzip.open(file_name, 'rt', encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def check_meta(file_name: str, meta: dict) -> dict:
+    if not meta or meta.get('type') != 'meta':
+        raise ValueError('{} is not a Boxberry snapshot'.format(file_name))
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version {} in {}'.format(meta.get('version'), file_name))
+    return meta
+
+
+def read_meta(file_name: str) -> dict:
+    records = iter_snapshot(file_name)
+    try:
+        return check_meta(file_name, next(records, None))
+    finally:
+        records.close()
+
+
+def load_snapshot(file_name: str) -> (set, dict):
+    """
+    :return: codes of all points from Boxberry response and {'bxb_<code>': detailed point}
+    """
+    records = iter_snapshot(file_name)
+    meta = check_meta(file_name, next(records, None))
+
+    detailed_points = {record['code']: record['point'] for record in records if record.get('type') == 'point'}
+    return set(meta['points_codes']), detailed_points
+
+
+def point_hashes(file_name: str) -> dict:
+    """
+    :return: {'bxb_<code>': hash of the point data}
+    """
+    return {
+        record['code']: hashlib.sha1(json.dumps(record['point'], sort_keys=True).encode()).hexdigest()
+        for record in iter_snapshot(file_name) if record.get('type') == 'point'
+    }
+
+
+def diff_snapshots(old_file_name: str, new_file_name: str) -> dict:
+    """
+    Added and removed points are taken from the codes of the whole Boxberry response. A snapshot of a run without
+    --force-update holds details of new and changed points only, so changed are points detailed in both snapshots
+    with different data
+    :return: sorted prefixed codes of added, removed and changed points
+    """
+    old_codes = {'bxb_{}'.format(code) for code in read_meta(old_file_name)['points_codes']}
+    new_codes = {'bxb_{}'.format(code) for code in read_meta(new_file_name)['points_codes']}
+    old_hashes = point_hashes(old_file_name)
+    new_hashes = point_hashes(new_file_name)
+    return {
+        'added': sorted(new_codes - old_codes),
+        'removed': sorted(old_codes - new_codes),
+        'changed': sorted(code for code in old_hashes.keys() & new_hashes.keys()
+                          if old_hashes[code] != new_hashes[code]),
+    }
+
+
+if __name__ == '__main__':
+    snapshot_arg_parser = argparse.ArgumentParser(description='Compares two Boxberry snapshots')
+    snapshot_arg_parser.add_argument('old', help='Older snapshot file')
+    snapshot_arg_parser.add_argument('new', help='Newer snapshot file')
+    args = snapshot_arg_parser.parse_args()
+
+    for change, codes in diff_snapshots(args.old, args.new).items():
+        print('{}: {}'.format(change, len(codes)))
+        for code in codes:
+            print('  {}'.format(code))
@@ -0,0 +1,262 @@
+"""
+Load/soak test of the sync on synthetic Boxberry points.
+
+Drives get_bxb_detailed_points, convert_bxb_to_ym and the delete/update/add outlet phases against in-process
+fakes of both APIs and a temporary SQLite db, for every requested number of points. Reports points per second
+of every phase, peak RSS of the process and the top allocators from tracemalloc, and exits with code 1 if a budget
+is exceeded. Phases are timed with tracing off, allocations are traced in a separate pass of the same size.
+
+Usage: python soak.py [--sizes 1000 10000 50000] [--max-rss-mb N] [--min-points-per-second N] [--top N]
+"""
+import argparse
+import configparser
+import logging
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import main
+from context import app
+from limiter import AdaptiveLimiter
+from normalize_dict import convert_region_names_for_yandex
+
+# (CityName, Area) as Boxberry returns them, weighted by the share of points
+CITIES = (
+    (('Москва', 'Москва г'), 30),
+    (('Санкт-Петербург', 'Санкт-Петербург г'), 12),
+    (('Химки', 'Московская обл'), 4),
+    (('Мытищи', 'Московская обл'), 3),
+    (('Гатчина', 'Ленинградская обл'), 2),
+    (('Екатеринбург', 'Свердловская обл'), 5),
+    (('Новосибирск', 'Новосибирская обл'), 5),
+    (('Казань', 'Татарстан Респ'), 4),
+    (('Ижевск', 'Удмуртская Респ'), 2),
+    (('Грозный', 'Чеченская Респ'), 1),
+    (('Сургут', 'Ханты-Мансийский Автономный округ - Югра АО'), 2),
+    (('Кемерово', 'Кемеровская область - Кузбасс обл'), 2),
+    (('Якутск', 'Саха /Якутия/ Респ'), 1),
+    (('Краснодар', 'Краснодарский край'), 5),
+    (('Самара', 'Самарская обл'), 4),
+    (('Пермь', 'Пермский край'), 3),
+    (('Уфа', 'Башкортостан Респ'), 3),
+    (('Владивосток', 'Приморский край'), 2),
+)
+
+# Most points share a handful of call-center numbers, the rest have local ones in various formats
+CALL_CENTER_PHONES = ('8-800-222-80-00', '8 (800) 700-54-30')
+LOCAL_PHONE_FORMATS = ('+7 ({}) {}-{}-{}', '8({}){}{}{}', '8 {} {} {} {}', '8-{}-{}-{}-{}')
+
+SCHEDULES = (
+    (('10.00', '21.00'),) * 7,
+    (('09.00', '20.00'),) * 5 + (('10.00', '16.00'),) * 2,
+    (('09.00', '18.00'),) * 5 + ((None, None),) * 2,
+    (('08.00', '22.00'),) * 6 + ((None, None),),
+)
+
+
+def generate_points(count: int, seed: int = 0) -> dict:
+    """
+    :return: {code: PointsDescription-like point} with realistic city, area, phone and schedule distributions
+    """
+    rnd = random.Random(seed)
+    cities, weights = zip(*CITIES)
+    points = dict()
+
+    for number in range(count):
+        code = str(10000 + number)
+        city_name, area = rnd.choices(cities, weights)[0]
+
+        if rnd.random() < 0.7:
+            phone = rnd.choice(CALL_CENTER_PHONES)
+        else:
+            phone = rnd.choice(LOCAL_PHONE_FORMATS).format(
+                rnd.randrange(300, 999), rnd.randrange(100, 999), rnd.randrange(10, 99), rnd.randrange(10, 99)
+            )
+
+        point = {
+            'Code': code,
+            'Name': '{}_{}'.format(city_name, code),
+            'CityName': city_name,
+            'Area': area,
+            'Address': '{}, ул. Ленина, д. {}'.format(city_name, rnd.randrange(1, 200)),
+            'Phone': phone,
+        }
+        for (begin, end, ym_key), (begin_time, end_time) in zip(main.SCHEDULE_DAYS, rnd.choice(SCHEDULES)):
+            point[begin] = begin_time
+            point[end] = end_time
+        points[code] = point
+
+    return points
+
+
+class FakeBoxberryClient:
+    def __init__(self, points: dict):
+        self.limiter = AdaptiveLimiter(name='FakeBoxberry', max_concurrency=2)
+        self._points = points
+
+    def get_points_codes_list(self, city_code: int = None):
+        return [{'Code': code, 'UpdateDate': '2020-01-01'} for code in self._points]
+
+    def get_point_info(self, point_code: str) -> dict:
+        return dict(self._points[point_code])
+
+    def get_point_rate(self, point_code: str, default_weight: int, target_start: str):
+        return {'price': 150 + int(point_code) % 300, 'delivery_period': 1 + int(point_code) % 7}
+
+
+class FakeYandexMarketClient:
+    def __init__(self, outlets: dict):
+        self.limiter = AdaptiveLimiter(name='FakeYandexMarket')
+        self.outlets = outlets
+
+    def get_outlets_by_type(self, outlet_type: str) -> dict:
+        return dict(self.outlets)
+
+    def post_outlet(self, bxb_point):
+        self.outlets[bxb_point['shopOutletCode']] = {'id': len(self.outlets), 'name': bxb_point['name']}
+
+    def update_outlet(self, outlet_id, bxb_point):
+        pass
+
+    def delete_outlet(self, outlet_id):
+        pass
+
+
+def soak_config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Boxberry': {'boxberry_token': 'soak', 'target_start': '010', 'default_weight': '500', 'picking_fee': '50'},
+        'YandexMarket': {'ym_token': 'soak', 'ym_client_id': 'soak', 'campaign_id': 'soak'},
+        'General': {'emails': 'soak@example.com'},
+    })
+    return config
+
+
+def seed_regions():
+    from models import YandexRegion
+
+    rows = []
+    for region_id, ((city_name, area), weight) in enumerate(CITIES, start=1):
+        point = convert_region_names_for_yandex({'CityName': city_name, 'Area': area})
+        rows.append({'city_name': city_name, 'region': point['Area'], 'yandex_id': region_id, 'updated': date.today()})
+    YandexRegion.bulk_upsert(rows)
+
+
+def timed_phase(results: list, phase: str, items_count: int, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    results.append((phase, items_count, elapsed))
+    return result
+
+
+def soak(points_count: int, emails: list) -> list:
+    """
+    :return: [(phase, items processed, seconds)]
+    """
+    points = generate_points(points_count)
+    codes = list(points)
+
+    # Half of the points are published already, and 5% more published outlets are gone from Boxberry
+    existing_ym_codes = {'bxb_{}'.format(code): {'id': number, 'name': code}
+                         for number, code in enumerate(codes[:points_count // 2])}
+    existing_ym_codes.update({'bxb_gone_{}'.format(number): {'id': -number, 'name': 'gone'}
+                              for number in range(points_count // 20)})
+
+    app.bxb_client = FakeBoxberryClient(points)
+    app.ym_client = FakeYandexMarketClient(dict(existing_ym_codes))
+    results = []
+
+    detailed_points = timed_phase(results, 'get_bxb_detailed_points', points_count, main.get_bxb_detailed_points,
+                                  set(codes), set(), '010', 500)
+
+    # On copies: conversion normalises Area in place, update and add phases convert the points again
+    timed_phase(results, 'convert_bxb_to_ym', len(detailed_points),
+                lambda: [main.convert_bxb_to_ym(code, dict(point), emails) for code, point in detailed_points.items()])
+
+    timed_phase(results, 'delete_missing_outlets', len(existing_ym_codes), main.delete_missing_outlets,
+                existing_ym_codes, codes)
+    timed_phase(results, 'update_existing_outlets', points_count // 2, main.update_existing_outlets,
+                existing_ym_codes, detailed_points, emails)
+    timed_phase(results, 'add_new_outlets', points_count - points_count // 2, main.add_new_outlets,
+                existing_ym_codes, detailed_points, emails)
+
+    return results
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main_soak():
+    soak_arg_parser = argparse.ArgumentParser(description='Load/soak test of the sync on synthetic Boxberry points')
+    soak_arg_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                                 help='Numbers of points to run with. Default: 1000 10000 50000')
+    soak_arg_parser.add_argument('--max-rss-mb', type=float, default=None,
+                                 help='Fails if peak RSS of the process exceeds this number of megabytes')
+    soak_arg_parser.add_argument('--min-points-per-second', type=float, default=None,
+                                 help='Fails if any phase processes fewer points per second')
+    soak_arg_parser.add_argument('--top', type=int, default=10,
+                                 help='Number of top allocators reported by tracemalloc, 0 disables tracing')
+    args = soak_arg_parser.parse_args()
+
+    logging.getLogger('BoxberryParserLog').setLevel(logging.WARNING)
+    db_dir = tempfile.mkdtemp(prefix='bxb_soak_')
+    app.database_url = 'sqlite:///{}'.format(os.path.join(db_dir, 'soak.db'))
+    app.config = soak_config()
+    emails = app.general_config['emails'].split(',')
+    app.session  # Creates tables
+    seed_regions()
+
+    failures = []
+    try:
+        for points_count in args.sizes:
+            # Timed pass without tracemalloc, tracing slows allocation-heavy phases down a lot
+            results = soak(points_count, emails)
+
+            print('\n{} points'.format(points_count))
+            for phase, items_count, elapsed in results:
+                points_per_second = items_count / elapsed if elapsed else float('inf')
+                print('  {:<26}{:>10} items{:>10.2f} s{:>12.0f} points/s'.format(phase, items_count, elapsed,
+                                                                               points_per_second))
+                if args.min_points_per_second and points_per_second < args.min_points_per_second:
+                    failures.append('{} points, {}: {:.0f} points/s is below {:.0f}'.format(
+                        points_count, phase, points_per_second, args.min_points_per_second))
+
+            # ru_maxrss is the peak of the whole process, so it also covers smaller sizes and their traced passes
+            rss = peak_rss_mb()
+            print('  peak RSS of the process so far {:.1f} MB'.format(rss))
+            if args.max_rss_mb and rss > args.max_rss_mb:
+                failures.append('{} points: peak RSS of the process {:.1f} MB exceeds {:.1f} MB'.format(
+                    points_count, rss, args.max_rss_mb))
+
+            if args.top:
+                # Separate untimed pass for allocations
+                tracemalloc.start()
+                try:
+                    soak(points_count, emails)
+                    traced_peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                    top_stats = tracemalloc.take_snapshot().statistics('lineno')[:args.top]
+                finally:
+                    tracemalloc.stop()
+                print('  traced peak {:.1f} MB, top allocators:'.format(traced_peak))
+                for stat in top_stats:
+                    print('    {}'.format(stat))
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    if failures:
+        print('\nBudget exceeded:')
+        for failure in failures:
+            print('  {}'.format(failure))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main_soak()
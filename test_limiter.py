@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from client import Client
+from limiter import AdaptiveLimiter
+
+
+def make_limiter(**kwargs) -> AdaptiveLimiter:
+    params = dict(name='Test', max_concurrency=3, initial_rate=1.0, min_rate=0.1, max_rate=2.0, rate_step=0.5,
+                  decrease_factor=0.5, success_window=3)
+    params.update(kwargs)
+    return AdaptiveLimiter(**params)
+
+
+def test_limits_grow_additively_after_success_window():
+    limiter = make_limiter()
+
+    for _ in range(2):
+        limiter.on_success()
+    assert (limiter.concurrency_limit, limiter.rate) == (1, 1.0)
+
+    limiter.on_success()
+    assert (limiter.concurrency_limit, limiter.rate) == (2, 1.5)
+
+
+def test_limits_are_capped():
+    limiter = make_limiter()
+
+    for _ in range(30):
+        limiter.on_success()
+
+    assert limiter.concurrency_limit == 3
+    assert limiter.rate == 2.0
+
+
+def test_limits_are_cut_multiplicatively_down_to_floors():
+    limiter = make_limiter()
+    for _ in range(6):
+        limiter.on_success()
+    assert (limiter.concurrency_limit, limiter.rate) == (3, 2.0)
+
+    limiter.on_throttle()
+    assert (limiter.concurrency_limit, limiter.rate) == (1, 1.0)
+
+    for _ in range(10):
+        limiter.on_throttle()
+    assert (limiter.concurrency_limit, limiter.rate) == (1, 0.1)
+
+
+def test_throttle_resets_success_window():
+    limiter = make_limiter()
+    limiter.on_success()
+    limiter.on_success()
+    limiter.on_throttle()
+    limiter.on_success()
+
+    assert limiter.rate == 0.5
+
+
+def test_requests_sent_before_a_cut_do_not_cut_again():
+    limiter = make_limiter(initial_rate=2.0)
+    sent_at = time.monotonic()
+
+    limiter.on_throttle(sent_at)
+    limiter.on_throttle(sent_at)
+    assert limiter.rate == 1.0
+
+    limiter.on_throttle(time.monotonic())
+    assert limiter.rate == 0.5
+
+
+def test_concurrency_limit_blocks_extra_requests():
+    limiter = make_limiter(initial_rate=1000.0)
+    acquired = threading.Event()
+
+    def acquire_second():
+        with limiter:
+            acquired.set()
+
+    with limiter:
+        thread = threading.Thread(target=acquire_second)
+        thread.start()
+        assert not acquired.wait(0.1)
+
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_slot_is_released_on_exception():
+    limiter = make_limiter(initial_rate=1000.0)
+
+    with pytest.raises(ValueError):
+        with limiter:
+            raise ValueError
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: limiter.acquire() or acquired.set())
+    thread.start()
+    assert acquired.wait(1)
+    thread.join()
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, text: str = '{}'):
+        self.status_code = status_code
+        self.text = text
+
+
+def make_client(status_codes: list) -> Client:
+    client = Client(max_attempts=10, limiter=make_limiter(initial_rate=1000.0, max_rate=2000.0))
+    client.service_name = 'Test'
+    responses = iter(FakeResponse(status_code) for status_code in status_codes)
+    client._session.send = lambda prepared_request, timeout: next(responses)
+    return client
+
+
+def test_not_found_does_not_cut_limits():
+    client = make_client([404, 200])
+
+    assert client.send(None) == {}
+    assert client.limiter.rate == 1000.0
+
+
+def test_rate_limit_responses_cut_limits():
+    client = make_client([429, 200])
+
+    assert client.send(None) == {}
+    assert client.limiter.rate == 500.0
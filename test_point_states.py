@@ -0,0 +1,132 @@
+import configparser
+from datetime import date, timedelta
+
+import pytest
+
+import main
+from context import app
+from errors import ClientConnectionError
+from limiter import AdaptiveLimiter
+from snapshot import export_snapshot
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database(tmp_path_factory):
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Boxberry': {'picking_fee': '0'},
+        'General': {'max_quarantine_days': '30'},
+    })
+    app.config = config
+    app.database_url = 'sqlite:///{}'.format(tmp_path_factory.mktemp('db') / 'test.db')
+    app.session
+
+
+@pytest.fixture(autouse=True)
+def clean_states():
+    from models import PointState
+
+    yield
+    app.session.query(PointState).delete()
+    app.session.commit()
+
+
+def days_later(monkeypatch, days: int):
+    class LaterDate(date):
+        @classmethod
+        def today(cls):
+            return date.today() + timedelta(days=days)
+
+    monkeypatch.setattr(main, 'date', LaterDate)
+
+
+def test_published_points_without_state_are_taken_as_unchanged():
+    assert main.get_points_to_skip({'1': 'v1'}, {'bxb_1': {'id': 1}}) == {'bxb_1'}
+
+
+def test_changed_published_point_is_fetched():
+    main.save_points_states({'1': 'v1'}, fetched_codes=set(), failed_codes=set())
+
+    assert main.get_points_to_skip({'1': 'v2'}, {'bxb_1': {'id': 1}}) == set()
+
+
+def test_changed_published_point_failed_to_update_is_retried_after_quarantine(monkeypatch):
+    published = {'bxb_1': {'id': 1}}
+    main.save_points_states({'1': 'v1'}, fetched_codes=set(), failed_codes=set())
+
+    assert main.get_points_to_skip({'1': 'v2'}, published) == set()
+    main.save_points_states({'1': 'v2'}, fetched_codes={'1'}, failed_codes={'1'})
+
+    # Quarantined until tomorrow
+    assert main.get_points_to_skip({'1': 'v2'}, published) == {'bxb_1'}
+
+    days_later(monkeypatch, 1)
+    assert main.get_points_to_skip({'1': 'v2'}, published) == set()
+
+    # A successful retry ends the quarantine, the point is unchanged from now on
+    main.save_points_states({'1': 'v2'}, fetched_codes={'1'}, failed_codes=set())
+    assert main.get_points_to_skip({'1': 'v2'}, published) == {'bxb_1'}
+
+
+def test_failing_new_point_backs_off(monkeypatch):
+    from models import PointState
+
+    for failures in range(1, 4):
+        assert main.get_points_to_skip({'1': 'v1'}, {}) == set()
+        main.save_points_states({'1': 'v1'}, fetched_codes={'1'}, failed_codes={'1'})
+
+        state = PointState.get_states()['1']
+        assert state.failures == failures
+        assert state.retry_after == main.date.today() + timedelta(days=2 ** (failures - 1))
+        assert main.get_points_to_skip({'1': 'v1'}, {}) == {'bxb_1'}
+
+        days_later(monkeypatch, (state.retry_after - date.today()).days)
+
+
+def test_changed_point_leaves_quarantine():
+    main.save_points_states({'1': 'v1'}, fetched_codes={'1'}, failed_codes={'1'})
+
+    assert main.get_points_to_skip({'1': 'v1'}, {}) == {'bxb_1'}
+    assert main.get_points_to_skip({'1': 'v2'}, {}) == set()
+
+
+def test_states_of_points_gone_from_boxberry_are_deleted():
+    from models import PointState
+
+    main.save_points_states({'1': 'v1', '2': 'v1'}, fetched_codes=set(), failed_codes=set())
+    main.save_points_states({'1': 'v1'}, fetched_codes=set(), failed_codes=set())
+
+    assert set(PointState.get_states()) == {'1'}
+
+
+class FakeBoxberryClient:
+    def __init__(self, failing_codes: set):
+        self.limiter = AdaptiveLimiter(name='FakeBoxberry', max_concurrency=2)
+        self._failing_codes = failing_codes
+
+    def get_point_info(self, point_code: str) -> dict:
+        if point_code in self._failing_codes:
+            raise ClientConnectionError(service='FakeBoxberry', error_text='Can not get data after 10 attempts')
+        return {'Name': point_code, 'CityName': 'Москва', 'Area': 'Москва г'}
+
+    def get_point_rate(self, point_code: str, default_weight: int, target_start: str):
+        return {'price': 100, 'delivery_period': 2}
+
+
+def test_point_out_of_retries_does_not_abort_fetch():
+    app.bxb_client = FakeBoxberryClient(failing_codes={'3'})
+    codes = {str(code) for code in range(10)}
+
+    detailed_points = main.get_bxb_detailed_points(codes, set(), '010', 500)
+
+    assert set(detailed_points) == {'bxb_{}'.format(code) for code in codes - {'3'}}
+
+
+def test_snapshot_replay_keeps_published_points(tmp_path):
+    file_name = str(tmp_path / 'snapshot.jsonl.gz')
+    export_snapshot(file_name, {'1', '2', '3'}, {'bxb_1': {'Name': 'changed'}, 'bxb_2': {'Name': 'new'}})
+
+    points_codes, detailed_points = main.load_bxb_points(file_name)
+
+    assert points_codes == {'1', '2', '3'}
+    assert set(detailed_points) == {'bxb_1', 'bxb_2'}
@@ -0,0 +1,55 @@
+import gzip
+
+import pytest
+
+from snapshot import diff_snapshots, export_snapshot, load_snapshot
+
+
+def test_export_and_load_round_trip(tmp_path):
+    file_name = str(tmp_path / 'snapshot.jsonl.gz')
+    detailed_points = {
+        'bxb_1': {'Name': 'Пункт выдачи', 'rate': 250, 'yandex_region_id': 213},
+        'bxb_2': {'Name': 'Другой пункт', 'rate': 300, 'yandex_region_id': None},
+    }
+
+    export_snapshot(file_name, {'1', '2', '3'}, detailed_points)
+
+    assert load_snapshot(file_name) == ({'1', '2', '3'}, detailed_points)
+
+
+def test_load_rejects_other_files(tmp_path):
+    file_name = str(tmp_path / 'not_a_snapshot.jsonl.gz')
+    with gzip.open(file_name, 'wt') as not_a_snapshot:
+        not_a_snapshot.write('{"type": "point"}\n')
+
+    with pytest.raises(ValueError):
+        load_snapshot(file_name)
+
+
+def test_diff_reports_added_removed_and_changed_points(tmp_path):
+    old_file_name = str(tmp_path / 'old.jsonl.gz')
+    new_file_name = str(tmp_path / 'new.jsonl.gz')
+    export_snapshot(old_file_name, {'1', '2', '3'}, {'bxb_1': {'rate': 100}, 'bxb_2': {'rate': 200},
+                                                     'bxb_3': {'rate': 300}})
+    export_snapshot(new_file_name, {'1', '3', '4'}, {'bxb_1': {'rate': 110}, 'bxb_3': {'rate': 300},
+                                                     'bxb_4': {'rate': 400}})
+
+    assert diff_snapshots(old_file_name, new_file_name) == {
+        'added': ['bxb_4'],
+        'removed': ['bxb_2'],
+        'changed': ['bxb_1'],
+    }
+
+
+def test_diff_of_partial_snapshots_uses_codes_of_whole_response(tmp_path):
+    # Runs without --force-update only detail new and changed points
+    old_file_name = str(tmp_path / 'old.jsonl.gz')
+    new_file_name = str(tmp_path / 'new.jsonl.gz')
+    export_snapshot(old_file_name, {'1', '2', '3'}, {'bxb_1': {'rate': 100}, 'bxb_2': {'rate': 200}})
+    export_snapshot(new_file_name, {'1', '2', '3', '5'}, {'bxb_1': {'rate': 120}, 'bxb_5': {'rate': 500}})
+
+    assert diff_snapshots(old_file_name, new_file_name) == {
+        'added': ['bxb_5'],
+        'removed': [],
+        'changed': ['bxb_1'],
+    }